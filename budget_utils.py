@@ -0,0 +1,144 @@
+import os
+import time
+from dotenv import load_dotenv
+
+from llm_utils import get_llm_usage
+from search_utils import get_search_usage
+
+load_dotenv()
+
+# --- Pricing used to estimate run cost (USD per 1K tokens) ---
+# Defaults match o3-mini list prices; override for other models.
+LLM_INPUT_COST_PER_1K = float(os.getenv("LLM_INPUT_COST_PER_1K", 0.0011))
+LLM_OUTPUT_COST_PER_1K = float(os.getenv("LLM_OUTPUT_COST_PER_1K", 0.0044))
+
+# Share of the budget held back for the final synthesis call. The time reserve is at least
+# MIN_SYNTHESIS_RESERVE_SECONDS, but never more than half of a short deadline.
+SYNTHESIS_RESERVE_FRACTION = 0.15
+MIN_SYNTHESIS_RESERVE_SECONDS = 10
+MIN_CONTENT_TOKEN_BUDGET = 500
+
+
+class RunBudget:
+    """
+    Tracks elapsed time, LLM tokens and search calls for one research run against an optional
+    deadline (seconds) and cost limit (USD), and turns what is left into research-shaping decisions:
+    how many search results to try, how much page content to send, how many sub-queries to follow,
+    whether to recurse at all, and when to stop and synthesize.
+
+    With neither limit set every method returns the caller's defaults, so behaviour is unchanged.
+    """
+
+    def __init__(self, deadline_seconds: float | None = None, max_cost_usd: float | None = None):
+        self.deadline_seconds = deadline_seconds
+        self.max_cost_usd = max_cost_usd
+        self.started_at = time.monotonic()
+        self._llm_start = get_llm_usage()
+        self._search_start = get_search_usage()
+        self._steps_completed = 0
+
+    @property
+    def is_limited(self) -> bool:
+        return self.deadline_seconds is not None or self.max_cost_usd is not None
+
+    # --- Spend ---
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def usage(self) -> dict:
+        """LLM tokens, search calls and estimated cost spent since this budget was created."""
+        llm_now, search_now = get_llm_usage(), get_search_usage()
+        prompt_tokens = llm_now["prompt_tokens"] - self._llm_start["prompt_tokens"]
+        completion_tokens = llm_now["completion_tokens"] - self._llm_start["completion_tokens"]
+        search_cost = search_now["cost_usd"] - self._search_start["cost_usd"]
+        llm_cost = prompt_tokens / 1000 * LLM_INPUT_COST_PER_1K + completion_tokens / 1000 * LLM_OUTPUT_COST_PER_1K
+        return {
+            "llm_calls": llm_now["calls"] - self._llm_start["calls"],
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "search_calls": search_now["calls"] - self._search_start["calls"],
+            "cost_usd": llm_cost + search_cost,
+        }
+
+    def remaining_fraction(self) -> float:
+        """Fraction (0-1) of the tighter of the two limits still available; 1.0 if unlimited."""
+        fractions = [1.0]
+        if self.deadline_seconds:
+            fractions.append(1 - self.elapsed_seconds() / self.deadline_seconds)
+        if self.max_cost_usd:
+            fractions.append(1 - self.usage()["cost_usd"] / self.max_cost_usd)
+        return max(0.0, min(fractions))
+
+    # --- Step accounting ---
+    def record_step(self):
+        """Marks one research step (source analyzed) as completed."""
+        self._steps_completed += 1
+
+    def _average_step_fraction(self) -> float:
+        """Average budget fraction one step has consumed so far (a conservative guess before the first step)."""
+        used = 1 - self.remaining_fraction()
+        if self._steps_completed == 0:
+            return 0.25
+        return used / self._steps_completed
+
+    def _reserve_fraction(self) -> float:
+        """Fraction of the budget held back for synthesis, widened so a deadline keeps its seconds reserve."""
+        if not self.deadline_seconds:
+            return SYNTHESIS_RESERVE_FRACTION
+        reserve_seconds = min(MIN_SYNTHESIS_RESERVE_SECONDS, self.deadline_seconds * 0.5)
+        return max(SYNTHESIS_RESERVE_FRACTION, reserve_seconds / self.deadline_seconds)
+
+    # --- Decisions ---
+    def should_stop(self) -> bool:
+        """
+        True once only the synthesis reserve is left: stop researching and synthesize.
+        Until the first step completes the reserve isn't enforced, so even a tight budget gathers
+        one source to synthesize from; only an exhausted budget stops the run then.
+        """
+        if not self.is_limited:
+            return False
+        if self._steps_completed == 0:
+            return self.remaining_fraction() <= 0
+        return self.remaining_fraction() <= self._reserve_fraction()
+
+    def can_afford_step(self) -> bool:
+        """True if another step (at the average cost of previous steps) still leaves the synthesis reserve."""
+        if not self.is_limited:
+            return True
+        return self.remaining_fraction() - self._average_step_fraction() > self._reserve_fraction()
+
+    def search_results_to_try(self, default: int) -> int:
+        """Scales the number of search results to request/try with the remaining budget (at least 1)."""
+        if not self.is_limited:
+            return default
+        return max(1, round(default * self.remaining_fraction()))
+
+    def content_token_budget(self, default: int) -> int:
+        """Scales the page-content token budget for the analysis prompt with the remaining budget."""
+        if not self.is_limited:
+            return default
+        return max(min(default, MIN_CONTENT_TOKEN_BUDGET), int(default * self.remaining_fraction()))
+
+    def breadth(self, default: int) -> int:
+        """Scales how many sub-queries to follow from one source with the remaining budget (at least 1)."""
+        if not self.is_limited:
+            return default
+        return max(1, round(default * self.remaining_fraction()))
+
+    def allow_map_pass(self) -> bool:
+        """The optional per-section map pass costs extra LLM calls; only allow it with most of the budget left."""
+        return not self.is_limited or self.remaining_fraction() > 0.5
+
+    def describe(self) -> str:
+        """One-line summary of spend against limits, for logs."""
+        usage = self.usage()
+        parts = [f"{self.elapsed_seconds():.1f}s"]
+        if self.deadline_seconds:
+            parts[0] += f" / {self.deadline_seconds:g}s"
+        cost = f"${usage['cost_usd']:.4f}"
+        if self.max_cost_usd:
+            cost += f" / ${self.max_cost_usd:g}"
+        parts.append(cost)
+        parts.append(f"{usage['llm_calls']} LLM calls ({usage['prompt_tokens']} in / {usage['completion_tokens']} out tokens)")
+        parts.append(f"{usage['search_calls']} search calls")
+        return ", ".join(parts)
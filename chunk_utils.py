@@ -0,0 +1,168 @@
+import re
+import tiktoken
+import numpy as np
+
+from relevance_utils import bm25_scores
+
+# --- Query-aware chunk selection for long pages ---
+# Splits extracted text into paragraph-based chunks, scores them against the query
+# locally (BM25), and keeps only the best chunks that fit a token budget.
+
+DEFAULT_ENCODING = "cl100k_base"
+CHUNK_SEPARATOR = "\n\n[...]\n\n" # Marks omitted text between non-adjacent selected chunks
+
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+CHARS_PER_TOKEN_ESTIMATE = 4 # Used only if the tiktoken encoding cannot be loaded (e.g. offline)
+
+_encoding = None
+_encoding_unavailable = False
+
+def _get_encoding():
+    """Loads the tiktoken encoding once (first call may download the BPE file). Returns None if unavailable."""
+    global _encoding, _encoding_unavailable
+    if _encoding is None and not _encoding_unavailable:
+        try:
+            _encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            print(f"⚠️ Could not load tiktoken encoding '{DEFAULT_ENCODING}' ({e}). Estimating tokens from character counts.")
+            _encoding_unavailable = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Returns the number of tokens in text using the shared tiktoken encoding (or a character-based estimate)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN_ESTIMATE)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text down to at most `max_tokens` tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN_ESTIMATE]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def split_into_chunks(text: str, max_chunk_tokens: int = 300) -> list[str]:
+    """
+    Splits text into chunks of roughly `max_chunk_tokens` tokens.
+    Paragraphs are kept whole where possible: short neighbouring paragraphs are merged,
+    and paragraphs longer than the limit are split on sentence boundaries.
+    """
+    pieces = []
+    for paragraph in _PARAGRAPH_SPLIT_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        paragraph_tokens = count_tokens(paragraph)
+        if paragraph_tokens <= max_chunk_tokens:
+            pieces.append((paragraph, paragraph_tokens))
+        else:
+            for sentence in _SENTENCE_SPLIT_RE.split(paragraph):
+                if sentence.strip():
+                    pieces.append((sentence.strip(), count_tokens(sentence)))
+
+    chunks = []
+    current_parts, current_tokens = [], 0
+    for piece, piece_tokens in pieces:
+        if current_parts and current_tokens + piece_tokens > max_chunk_tokens:
+            chunks.append("\n\n".join(current_parts))
+            current_parts, current_tokens = [], 0
+        current_parts.append(piece)
+        current_tokens += piece_tokens
+    if current_parts:
+        chunks.append("\n\n".join(current_parts))
+    return chunks
+
+
+def rank_chunks(query: str, chunks: list[str]) -> list[int]:
+    """Returns chunk indices ordered from most to least relevant to the query (document order breaks ties)."""
+    if not chunks:
+        return []
+    scores = bm25_scores(query, chunks)
+    return [int(i) for i in np.argsort(-scores, kind="stable")]
+
+
+def select_relevant_chunks(query: str, text: str, token_budget: int, max_chunk_tokens: int = 300) -> str:
+    """
+    Returns the most query-relevant parts of `text` that fit within `token_budget` tokens,
+    in their original document order. Text already within budget is returned unchanged.
+    """
+    if not text or count_tokens(text) <= token_budget:
+        return text
+
+    chunks = split_into_chunks(text, max_chunk_tokens)
+    chunk_tokens = [count_tokens(chunk) for chunk in chunks]
+    selected, used_tokens = [], 0
+    for i in rank_chunks(query, chunks):
+        if used_tokens + chunk_tokens[i] > token_budget:
+            continue
+        selected.append(i)
+        used_tokens += chunk_tokens[i]
+
+    if not selected: # Every chunk is over budget on its own; fall back to a hard cut of the best one
+        return truncate_to_tokens(chunks[rank_chunks(query, chunks)[0]], token_budget)
+
+    selected.sort()
+    parts = [chunks[selected[0]]]
+    for prev, cur in zip(selected, selected[1:]):
+        parts.append("\n\n" if cur == prev + 1 else CHUNK_SEPARATOR)
+        parts.append(chunks[cur])
+    return "".join(parts)
+
+
+def _pack_in_order(selected: list[int], chunk_tokens: list[int], token_budget: int) -> list[list[int]]:
+    """Packs sorted chunk indices, in document order, into groups of at most `token_budget` tokens."""
+    groups, current, current_tokens = [], [], 0
+    for i in selected:
+        if current and current_tokens + chunk_tokens[i] > token_budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += chunk_tokens[i]
+    if current:
+        groups.append(current)
+    return groups
+
+
+def group_relevant_chunks(query: str, text: str, token_budget: int, max_groups: int, max_chunk_tokens: int = 300) -> list[str]:
+    """
+    For very long sources: selects the best chunks and packs them (in document order) into at most
+    `max_groups` groups of at most `token_budget` tokens each, so each group can be sent to the LLM
+    separately in a map pass. A chunk is only selected if the packed groups still fit in `max_groups`,
+    so higher-ranked chunks are never pushed out by lower-ranked ones.
+    """
+    chunks = split_into_chunks(text, max_chunk_tokens)
+    chunk_tokens = [count_tokens(chunk) for chunk in chunks]
+    selected = []
+    for i in rank_chunks(query, chunks):
+        if chunk_tokens[i] > token_budget:
+            continue
+        candidate = sorted(selected + [i])
+        if len(_pack_in_order(candidate, chunk_tokens, token_budget)) <= max_groups:
+            selected = candidate
+    return ["\n\n".join(chunks[i] for i in group) for group in _pack_in_order(selected, chunk_tokens, token_budget)]
+
+
+if __name__ == '__main__':
+    print("--- Testing chunk_utils.py ---")
+    test_query = "surface code error thresholds"
+    filler = "This paragraph talks about the history of the company cafeteria and its menu. " * 8
+    relevant = "Surface code error thresholds near one percent make fault-tolerant quantum computing practical."
+    test_text = "\n\n".join([filler] * 10 + [relevant] + [filler] * 10)
+
+    print(f"Full text tokens: {count_tokens(test_text)}")
+    selected_text = select_relevant_chunks(test_query, test_text, token_budget=200, max_chunk_tokens=100)
+    print(f"Selected text tokens: {count_tokens(selected_text)}")
+    print(f"Relevant paragraph kept: {relevant in selected_text}")
+    groups = group_relevant_chunks(test_query, test_text, token_budget=200, max_groups=3, max_chunk_tokens=100)
+    print(f"Map-pass groups: {len(groups)} with tokens {[count_tokens(g) for g in groups]}")
+    # Chunks just over half the group budget can't share a group; the best chunk must still be kept
+    groups = group_relevant_chunks(test_query, test_text, token_budget=150, max_groups=3, max_chunk_tokens=110)
+    print(f"Half-full groups: {len(groups)}, relevant paragraph kept: {any(relevant in g for g in groups)}")
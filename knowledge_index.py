@@ -0,0 +1,227 @@
+import time
+import zlib
+import sqlite3
+from dataclasses import dataclass
+import numpy as np
+
+from relevance_utils import tokenize, content_relevance_score
+from chunk_utils import split_into_chunks
+
+# --- Cross-run local knowledge index ---
+# A persistent SQLite file holding findings from past runs: source URL, title, the query it
+# answered, the LLM summary and suggested queries, the extracted text split into chunks, and
+# when it was fetched. Chunks are searchable by full text (SQLite FTS5, BM25-ranked) and by
+# vector similarity (hashed bag-of-words embeddings, cosine via NumPy), so a new run can reuse
+# fresh prior findings before spending search, browser and LLM time on the web.
+
+EMBEDDING_DIM = 512
+RRF_K = 60
+
+
+@dataclass(slots=True)
+class KnowledgeHit:
+    """A prior finding retrieved from the index."""
+    url: str
+    title: str
+    query: str
+    summary: str
+    generated_queries: tuple[str, ...]
+    fetched_at: float
+    score: float # Query-term coverage of summary + best matching chunk, in [0, 1] (0 if any term is missing)
+
+
+def embed_text(text: str) -> np.ndarray:
+    """
+    Hashed bag-of-words embedding: tokens are hashed (stable CRC32) into EMBEDDING_DIM buckets
+    with sublinear term frequency, then L2-normalized. Cheap, local and deterministic across runs.
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    tokens = tokenize(text)
+    if not tokens:
+        return vector
+    buckets = np.fromiter((zlib.crc32(t.encode("utf-8")) % EMBEDDING_DIM for t in tokens), dtype=np.int64, count=len(tokens))
+    counts = np.bincount(buckets, minlength=EMBEDDING_DIM).astype(np.float32)
+    np.log1p(counts, out=counts)
+    norm = np.linalg.norm(counts)
+    return counts / norm if norm > 0 else counts
+
+
+class KnowledgeIndex:
+    """
+    Persistent index of past research findings.
+
+    Args:
+        path (str): SQLite database file (created if missing).
+        max_age_days (float): Findings fetched longer ago than this are not reused.
+        min_score (float): Minimum query-term coverage (0-1) for a prior finding to be reused. Coverage is
+                           the weakest query term's score, so every query term must appear (0.6 = at least once).
+    """
+
+    def __init__(self, path: str, max_age_days: float = 7, min_score: float = 0.6, chunk_tokens: int = 300):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.min_score = min_score
+        self.chunk_tokens = chunk_tokens
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE NOT NULL,
+                title TEXT,
+                query TEXT,
+                summary TEXT,
+                generated_queries TEXT,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+                chunk_index INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                embedding BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source_id ON chunks(source_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+        """)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        # Lazily loaded (chunk_ids, source_ids, embedding matrix) for vector search
+        self._vectors = None
+
+    # --- Writing ---
+    def add_finding(self, url: str, title: str, query: str, summary: str, generated_queries: list[str], content: str | None):
+        """Stores (or replaces) the finding for `url`, chunking and embedding its content."""
+        # The summary is indexed as chunk 0 so findings are retrievable even without stored content
+        chunks = [summary] if summary else []
+        if content:
+            chunks.extend(split_into_chunks(content, self.chunk_tokens))
+        if not chunks:
+            return
+        with self._conn:
+            self._conn.execute("DELETE FROM sources WHERE url = ?", (url,))
+            cursor = self._conn.execute(
+                "INSERT INTO sources (url, title, query, summary, generated_queries, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, title, query, summary, "\n".join(generated_queries or []), time.time())
+            )
+            source_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO chunks (source_id, chunk_index, text, embedding) VALUES (?, ?, ?, ?)",
+                [(source_id, i, chunk, embed_text(chunk).tobytes()) for i, chunk in enumerate(chunks)]
+            )
+        self._vectors = None
+
+    # --- Searching ---
+    def search_text(self, query: str, limit: int = 20) -> list[tuple[int, int]]:
+        """Full-text (FTS5 BM25) search. Returns (chunk_id, source_id) pairs, best first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        match_expr = " OR ".join(f'"{term}"' for term in terms)
+        rows = self._conn.execute(
+            "SELECT chunks.id, chunks.source_id FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+            (match_expr, limit)
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def search_similar(self, query: str, limit: int = 20) -> list[tuple[int, int]]:
+        """Vector (cosine) search over chunk embeddings. Returns (chunk_id, source_id) pairs, best first."""
+        if self._vectors is None:
+            rows = self._conn.execute("SELECT id, source_id, embedding FROM chunks").fetchall()
+            if rows:
+                self._vectors = (
+                    np.array([r[0] for r in rows]),
+                    np.array([r[1] for r in rows]),
+                    np.vstack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                )
+            else:
+                self._vectors = (np.array([], dtype=int), np.array([], dtype=int), np.zeros((0, EMBEDDING_DIM), dtype=np.float32))
+        chunk_ids, source_ids, matrix = self._vectors
+        if not len(chunk_ids):
+            return []
+        similarities = matrix @ embed_text(query)
+        top = np.argsort(-similarities)[:limit]
+        return [(int(chunk_ids[i]), int(source_ids[i])) for i in top if similarities[i] > 0]
+
+    def lookup(self, query: str, exclude_urls: set | None = None, limit: int = 1) -> list[KnowledgeHit]:
+        """
+        Returns up to `limit` fresh prior findings relevant enough to `query` to be reused instead of
+        searching the web. Full-text and vector candidates are merged with reciprocal-rank fusion,
+        then each source is checked for freshness and query-term coverage (summary + best chunk).
+        A finding that covers only part of the query (e.g. "basics" for a "latest advancements" query)
+        is not reused, so that gap still goes to the web.
+        """
+        fused_scores = {}
+        best_chunk = {}
+        for ranked in (self.search_text(query), self.search_similar(query)):
+            for rank, (chunk_id, source_id) in enumerate(ranked, start=1):
+                fused_scores[source_id] = fused_scores.get(source_id, 0.0) + 1.0 / (RRF_K + rank)
+                best_chunk.setdefault(source_id, chunk_id)
+        if not fused_scores:
+            return []
+
+        min_fetched_at = time.time() - self.max_age_days * 86400
+        hits = []
+        for source_id in sorted(fused_scores, key=fused_scores.get, reverse=True):
+            row = self._conn.execute(
+                "SELECT url, title, query, summary, generated_queries, fetched_at FROM sources WHERE id = ?",
+                (source_id,)
+            ).fetchone()
+            if not row or row[5] < min_fetched_at or (exclude_urls and row[0] in exclude_urls):
+                continue
+            chunk_text = self._conn.execute("SELECT text FROM chunks WHERE id = ?", (best_chunk[source_id],)).fetchone()[0]
+            score = content_relevance_score(query, f"{row[3]}\n\n{chunk_text}", require_all_terms=True)
+            if score < self.min_score:
+                continue
+            hits.append(KnowledgeHit(
+                url=row[0],
+                title=row[1],
+                query=row[2],
+                summary=row[3],
+                generated_queries=tuple(q for q in (row[4] or "").split("\n") if q),
+                fetched_at=row[5],
+                score=score
+            ))
+            if len(hits) >= limit:
+                break
+        return hits
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    print("--- Testing knowledge_index.py ---")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = KnowledgeIndex(os.path.join(tmp_dir, "test_index.sqlite3"))
+        index.add_finding(
+            url="https://example.com/surface-codes",
+            title="Surface codes",
+            query="quantum error correction",
+            summary="Surface codes are a leading quantum error correction scheme with thresholds near 1%.",
+            generated_queries=["surface code threshold experiments"],
+            content="Surface codes arrange physical qubits on a lattice.\n\nLogical error rates fall as code distance grows."
+        )
+        index.add_finding(
+            url="https://example.com/bread",
+            title="Banana bread",
+            query="baking",
+            summary="A recipe for banana bread.",
+            generated_queries=[],
+            content="Mash the bananas and mix with flour."
+        )
+        print(f"Sources indexed: {len(index)}")
+        for test_query in ["quantum error correction surface codes", "latest advancements in quantum error correction", "banana bread recipe", "stock market news"]:
+            hits = index.lookup(test_query)
+            print(f"  \"{test_query}\" -> {[(h.url, round(h.score, 2)) for h in hits]}")
+        index.close()
@@ -1,6 +1,8 @@
 import os
+import re
 import json
-from openai import OpenAI
+import threading
+from openai import OpenAI, BadRequestError
 from dotenv import load_dotenv
 from pydantic import BaseModel, ValidationError, Field # For data validation
 from typing import List, Optional
@@ -11,32 +13,97 @@ load_dotenv()
 # --- Configuration ---
 API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "o3-mini") # Using your preferred model
+# Ask the API for JSON-schema structured output on analysis calls. Set to "false" for models/endpoints that reject it.
+USE_STRUCTURED_OUTPUTS = os.getenv("OPENAI_STRUCTURED_OUTPUTS", "true").strip().lower() not in ("0", "false", "no")
+# Set once the API rejects `response_format` for this model, so later calls don't pay a failed round trip first.
+_response_format_rejected = False
 
 if not API_KEY:
     raise ValueError("CRITICAL: OPENAI_API_KEY not found in .env file or environment variables.")
 
 client = OpenAI(api_key=API_KEY)
 
+# --- Usage Accounting ---
+# Running totals across all LLM calls in this process (including background threads);
+# callers such as the run budget take snapshots and work with the difference.
+_usage_lock = threading.Lock()
+llm_usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+def get_llm_usage() -> dict:
+    """Returns a snapshot of the cumulative LLM call and token counts."""
+    with _usage_lock:
+        return dict(llm_usage)
+
+def _record_llm_usage(response):
+    usage = getattr(response, "usage", None)
+    with _usage_lock:
+        llm_usage["calls"] += 1
+        if usage is not None:
+            llm_usage["prompt_tokens"] += usage.prompt_tokens or 0
+            llm_usage["completion_tokens"] += usage.completion_tokens or 0
+
 # --- Pydantic Models for LLM Response Validation ---
 class LLMAnalysisResponse(BaseModel):
     summary: str
     queries: List[str] = Field(default_factory=list) # Default to empty list
 
+def build_json_schema_response_format(model: type[BaseModel], name: str) -> dict:
+    """
+    Builds an OpenAI `response_format` payload (strict JSON schema) from a Pydantic model.
+    Strict mode requires every property to be listed as required and no extra properties.
+    """
+    schema = model.model_json_schema()
+    schema["required"] = list(schema.get("properties", {}).keys())
+    schema["additionalProperties"] = False
+    for prop in schema.get("properties", {}).values():
+        prop.pop("default", None) # Defaults are not allowed in strict schemas
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema, "strict": True},
+    }
+
+# Generated once at import; passed to get_llm_response for content analysis calls.
+ANALYSIS_RESPONSE_FORMAT = build_json_schema_response_format(LLMAnalysisResponse, "llm_analysis_response")
+
 # --- Core LLM Interaction ---
-def get_llm_response(prompt_text, system_message="You are a helpful research assistant."):
-    # ... (this function remains the same as before) ...
+def _is_response_format_error(error: BadRequestError) -> bool:
+    """True if a 400 is about `response_format` / the JSON schema, not e.g. context length or a bad message."""
+    if getattr(error, "param", None) == "response_format":
+        return True
+    message = str(error).lower()
+    return "response_format" in message or "json_schema" in message
+
+def get_llm_response(prompt_text, system_message="You are a helpful research assistant.", response_format: Optional[dict] = None):
+    """
+    Sends a single chat completion request and returns the message text (or None on error).
+    If `response_format` is given and the API rejects it (a 400 pointing at `response_format`), the call
+    is retried once without it and `response_format` is no longer sent for the rest of the run.
+    """
+    global _response_format_rejected
+    if _response_format_rejected:
+        response_format = None
     print(f"💬 Calling LLM (model: {MODEL_NAME})...")
+    request_kwargs = {
+        "model": MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt_text}
+        ],
+        #"temperature": 0.7,
+    }
+    if response_format:
+        request_kwargs["response_format"] = response_format
     try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt_text}
-            ],
-            #temperature=0.7,
-            # response_format={"type": "json_object"}, # Consider if 'o3-mini' supports it well
-        )
+        response = client.chat.completions.create(**request_kwargs)
+        _record_llm_usage(response)
         return response.choices[0].message.content
+    except BadRequestError as e:
+        if response_format and _is_response_format_error(e):
+            print(f"⚠️ Model rejected structured output ({e}). Retrying and continuing without response_format...")
+            _response_format_rejected = True
+            return get_llm_response(prompt_text, system_message=system_message)
+        print(f"❌ Error calling OpenAI API: {e}")
+        return None
     except Exception as e:
         print(f"❌ Error calling OpenAI API: {e}")
         return None
@@ -74,6 +141,18 @@ Example JSON format:
 }}
 """
 
+def extract_notes_prompt(current_query, content_section, source_url, section_index, section_count):
+    """Map-pass prompt: condenses one section of a very long source into query-relevant notes."""
+    return f"""You are an AI research assistant. Your current high-level research query is: "{current_query}".
+Below is section {section_index} of {section_count} selected from a long document at {source_url}.
+--- BEGIN SECTION ---
+{content_section}
+--- END SECTION ---
+
+Extract the facts, figures and claims from this section that are relevant to the query "{current_query}".
+Return them as concise plain-text bullet points (max 120 words). If nothing is relevant, return "No relevant information."
+"""
+
 def refine_answer_prompt(initial_query, research_findings_context):
     # ... (same as the version in our last iteration of llm_utils.py) ...
     return f"""You are an AI research synthesizer.
@@ -92,58 +171,203 @@ Structure your answer clearly. If there are conflicting points in the summaries,
 
 
 # --- Response Parsing with Pydantic Validation ---
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*(.*?)\s*(?:```\s*)?$", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_UNQUOTED_KEY_RE = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)')
+_DOUBLE_QUOTED_STRING_RE = re.compile(r'("(?:[^"\\]|\\.)*")')
+_SINGLE_QUOTED_STRING_RE = re.compile(r"'((?:[^'\\\n]|\\.)*)'")
+
+def _strip_code_fences(text: str) -> str:
+    """Removes a surrounding ```json ... ``` (or bare ```) fence, if present."""
+    stripped = text.strip()
+    match = _CODE_FENCE_RE.match(stripped)
+    return match.group(1).strip() if match else stripped
+
+def _split_open_trailing_string(text: str) -> tuple[str, str]:
+    """
+    Splits off an unterminated string at the end of truncated JSON.
+    Returns (head, open_string); open_string is "" if every string is closed.
+    """
+    in_string = False
+    escaped = False
+    string_start = 0
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            string_start = i
+    if in_string:
+        return text[:string_start], text[string_start:]
+    return text, ""
+
+def _end_of_first_object(text: str, quote: str = '"') -> int:
+    """
+    Returns the index just past the `}` closing the object that opens at text[0], skipping braces
+    inside `quote`-delimited string literals, or -1 if the object is never closed (truncated).
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                in_string = False
+        elif ch == quote:
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+def repair_json_text(text: str) -> str:
+    """
+    Cheap local repair pass for common LLM JSON mistakes, applied before giving up or re-asking:
+    prose around the object, single-quoted strings, unquoted keys, trailing commas,
+    and truncated output (unterminated string / unclosed brackets).
+    """
+    candidate = _strip_code_fences(text)
+
+    # Keep only the first complete JSON object if the model wrapped it in prose
+    first_brace = candidate.find("{")
+    if first_brace > 0:
+        candidate = candidate[first_brace:]
+    if first_brace != -1:
+        object_end = _end_of_first_object(candidate, quote='"' if '"' in candidate else "'")
+        if object_end != -1:
+            candidate = candidate[:object_end]
+
+    if '"' not in candidate:
+        # No double quotes anywhere, so the body can be reused as-is once \' is unescaped
+        candidate = _SINGLE_QUOTED_STRING_RE.sub(lambda m: '"' + m.group(1).replace("\\'", "'") + '"', candidate)
+    # Key quoting and trailing-comma fixes only apply outside of string literals,
+    # including a string left open by truncation
+    head, open_string = _split_open_trailing_string(candidate)
+    segments = _DOUBLE_QUOTED_STRING_RE.split(head)
+    for i in range(0, len(segments), 2):
+        segments[i] = _TRAILING_COMMA_RE.sub(r"\1", _UNQUOTED_KEY_RE.sub(r'\1"\2"\3', segments[i]))
+    candidate = "".join(segments) + open_string
+
+    # Close anything left open by a truncated response
+    closers = []
+    in_string = False
+    escaped = False
+    for ch in candidate:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+    if in_string:
+        candidate += '"'
+    if closers:
+        candidate = _TRAILING_COMMA_RE.sub(r"\1", candidate.rstrip().rstrip(",") + "".join(reversed(closers)))
+    return candidate
+
+def _parse_analysis_json(response_text: str) -> Optional[LLMAnalysisResponse]:
+    """
+    Returns a validated LLMAnalysisResponse, or None if the text cannot be parsed even after repair.
+    Fast path is a single `model_validate_json` call (the normal case with structured outputs).
+    """
+    try:
+        return LLMAnalysisResponse.model_validate_json(response_text)
+    except ValidationError:
+        pass
+
+    repaired = repair_json_text(response_text)
+    try:
+        validated_data = LLMAnalysisResponse.model_validate_json(repaired)
+        print("🩹 LLM response JSON required local repair before validation.")
+        return validated_data
+    except ValidationError as e:
+        print("❌ LLM response could not be parsed as the expected JSON schema:")
+        for error in e.errors():
+            print(f"   Field: {error['loc']}, Message: {error['msg']}, Type: {error['type']}")
+        print(f"   Raw response snippet: {response_text[:500]}")
+
+    # Last resort: salvage fields from a JSON object that parsed but failed schema validation
+    try:
+        data = json.loads(repaired)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(data, dict):
+        summary_salvaged = data.get("summary", "")
+        queries_salvaged = data.get("queries", [])
+        if not isinstance(summary_salvaged, str): summary_salvaged = ""
+        if not isinstance(queries_salvaged, list): queries_salvaged = []
+        queries_salvaged = [q for q in queries_salvaged if isinstance(q, str)]
+        if summary_salvaged or queries_salvaged:
+            print(f"   Using salvaged data: summary present = {bool(summary_salvaged)}, queries found = {len(queries_salvaged)}")
+            return LLMAnalysisResponse(summary=summary_salvaged, queries=queries_salvaged)
+    return None
+
 def parse_llm_analysis_response(response_text: Optional[str]):
     """
     Parses the JSON response from the LLM for content analysis using Pydantic.
-    Expects keys "summary" and "queries".
+    Expects keys "summary" and "queries". Returns ("", []) if nothing usable could be parsed.
     """
     if not response_text:
         print("⚠️ LLM response was empty, cannot parse.")
         return "", []
-    
-    raw_json_str = response_text
-    try:
-        # Attempt to strip markdown code block fences if present
-        if response_text.strip().startswith("```json"):
-            raw_json_str = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.strip().startswith("```"):
-            raw_json_str = response_text.split("```")[1].strip()
-        else:
-            raw_json_str = response_text.strip()
-
-        data = json.loads(raw_json_str) # First, ensure it's valid JSON
-        
-        # Validate with Pydantic
-        validated_data = LLMAnalysisResponse(**data)
-        print("✅ LLM response JSON structure validated with Pydantic.")
-        return validated_data.summary, validated_data.queries
-
-    except json.JSONDecodeError as e:
-        print(f"❌ LLM response was not valid JSON: {e}")
-        print(f"   Raw response snippet: {response_text[:500]}")
-        return "", []
-    except ValidationError as e:
-        print(f"❌ LLM response JSON did not match expected schema (Pydantic validation failed):")
-        for error in e.errors():
-             print(f"   Field: {error['loc']}, Message: {error['msg']}, Type: {error['type']}")
-        print(f"   Raw JSON attempted: {raw_json_str[:500]}")
-        # Attempt to salvage if possible, or return defaults
-        # For example, if only 'summary' is present and 'queries' is missing, Pydantic handles default_factory
-        # If summary is missing, it's a bigger issue. For now, return defaults on validation error.
-        summary_salvaged = ""
-        queries_salvaged = []
-        if isinstance(data, dict): # if json.loads worked but pydantic failed
-            summary_salvaged = data.get("summary", "")
-            queries_salvaged = data.get("queries", [])
-            if not isinstance(queries_salvaged, list): queries_salvaged = []
-            if summary_salvaged or queries_salvaged:
-                 print(f"   Attempting to use salvaged data: summary present = {bool(summary_salvaged)}, queries found = {len(queries_salvaged)}")
-                 return summary_salvaged, queries_salvaged
-        return "", [] # Default on critical Pydantic error and no salvage
-    except Exception as e:
-        print(f"❌ Unexpected error parsing LLM response: {e}")
-        print(f"   Raw response snippet: {response_text[:500]}")
+
+    validated_data = _parse_analysis_json(response_text)
+    if validated_data is None:
         return "", []
+    print("✅ LLM response JSON structure validated with Pydantic.")
+    return validated_data.summary, validated_data.queries
+
+def get_llm_analysis(prompt_text: str, max_reasks: int = 1):
+    """
+    Runs a content-analysis call with structured output and parses it.
+    If the response is still unparseable after local repair, re-asks the model (up to `max_reasks` times)
+    with the bad output and a request to return only valid JSON.
+
+    Returns:
+        tuple | None: (summary, queries), or None if the LLM call itself failed.
+    """
+    response_format = ANALYSIS_RESPONSE_FORMAT if USE_STRUCTURED_OUTPUTS else None
+    response_text = get_llm_response(prompt_text, response_format=response_format)
+    if not response_text:
+        return None
+
+    for attempt in range(max_reasks + 1):
+        validated_data = _parse_analysis_json(response_text)
+        if validated_data is not None:
+            print("✅ LLM response JSON structure validated with Pydantic.")
+            return validated_data.summary, validated_data.queries
+        if attempt == max_reasks:
+            break
+        print(f"🔁 Re-asking LLM for valid JSON (attempt {attempt + 1}/{max_reasks})...")
+        reask_prompt = f"""Your previous reply could not be parsed as JSON:
+--- BEGIN PREVIOUS REPLY ---
+{response_text[:4000]}
+--- END PREVIOUS REPLY ---
+
+Return the same content *only* as a valid JSON object with two keys: "summary" (a string) and "queries" (a list of strings)."""
+        response_text = get_llm_response(reask_prompt, response_format=response_format)
+        if not response_text:
+            break
+    return "", []
 
 # ... (if __name__ == '__main__': block for testing can be updated to use Pydantic model if needed)
 if __name__ == '__main__':
@@ -190,6 +414,21 @@ if __name__ == '__main__':
     print(f"  Parsed Summary: {summary}") # Might be salvaged
     print(f"  Parsed Queries: {queries}") # Should be [] due to salvage or pydantic error
 
+    print("\nTesting response with trailing comma (should be repaired locally):")
+    summary, queries = parse_llm_analysis_response('{"summary": "Trailing comma.", "queries": ["a", "b",],}')
+    print(f"  Parsed Summary: {summary}")
+    print(f"  Parsed Queries: {queries}")
+
+    print("\nTesting truncated response (should be repaired locally):")
+    summary, queries = parse_llm_analysis_response('{"summary": "Cut off mid', )
+    print(f"  Parsed Summary: {summary}")
+    print(f"  Parsed Queries: {queries}")
+
+    print("\nTesting trailing prose with braces (should be trimmed locally):")
+    summary, queries = parse_llm_analysis_response('{"summary": "Trailing note.", "queries": []}\n\nNote: {done}')
+    print(f"  Parsed Summary: {summary}")
+    print(f"  Parsed Queries: {queries}")
+
     print("\nTesting bad JSON response:")
     summary, queries = parse_llm_analysis_response(mock_llm_json_response_bad_json)
     print(f"  Parsed Summary: {summary}")
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 
 # Import the main research function from our agent
 from research_agent import run_deep_research
+from research_store import ResearchStore
 
 # Load environment variables from .env at the very beginning
 load_dotenv()
@@ -16,9 +17,10 @@ DEFAULT_MAX_DEPTH = int(os.getenv("MAX_DEPTH", 2))
 DEFAULT_OUTPUT_PREFIX = "research_report"
 
 # --- Helper Function for Saving Output ---
-def save_research_to_markdown(initial_query: str, final_answer: str, all_research_data: list, filename_prefix: str):
+def save_research_to_markdown(initial_query: str, final_answer: str, all_research_data: ResearchStore, filename_prefix: str):
     """
     Saves the research findings and final answer to a timestamped markdown file.
+    Records are written one at a time as they are read from the store.
     """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     # Sanitize a part of the query for a more descriptive filename
@@ -44,12 +46,14 @@ def save_research_to_markdown(initial_query: str, final_answer: str, all_researc
                 # Group by depth for potentially better readability if output gets very long
                 # For now, iterate as processed
                 for item in all_research_data:
-                    f.write(f"### 🔎 Step: Depth {item['depth']} - Searched for: \"{item['query']}\"\n\n")
-                    f.write(f"- **Source URL:** [{item.get('title', 'N/A')}]({item['url']})\n")
+                    f.write(f"### 🔎 Step: Depth {item.depth} - Searched for: \"{item.query}\"\n\n")
+                    f.write(f"- **Source URL:** [{item.title or 'N/A'}]({item.url})\n")
+                    if item.from_index:
+                        f.write("- **Reused from local knowledge index** (prior research, not re-fetched this run)\n")
                     f.write(f"- **LLM Summary of Source:**\n")
-                    f.write(f"  ```text\n  {item.get('summary', 'No summary extracted.')}\n  ```\n")
+                    f.write(f"  ```text\n  {item.summary or 'No summary extracted.'}\n  ```\n")
                     
-                    generated_queries = item.get('generated_queries')
+                    generated_queries = item.generated_queries
                     if generated_queries:
                         f.write(f"- **LLM Suggested Next Queries from this Source:**\n")
                         for i, gq_val in enumerate(generated_queries):
@@ -62,7 +66,7 @@ def save_research_to_markdown(initial_query: str, final_answer: str, all_researc
                     
                     # Optionally include raw content snippet (can make file very large)
                     # f.write(f"- **Raw Content Snippet (first 250 chars):**\n")
-                    # f.write(f"  ```text\n  {item.get('raw_content_snippet', '')}\n  ```\n\n")
+                    # f.write(f"  ```text\n  {(all_research_data.get_content(item) or '')[:250]}\n  ```\n\n")
                     f.write("\n---\n\n")
             
             f.write(f"\n\n*Report generated by Deep Research Python Script.*\n")
@@ -71,6 +75,22 @@ def save_research_to_markdown(initial_query: str, final_answer: str, all_researc
         print(f"❌ Error saving report to {filename}: {e}")
 
 
+def report_research_results(query: str, final_answer: str, all_research_data: ResearchStore, output: str):
+    """Prints the outcome of a research run and saves the markdown report if there is anything to save."""
+    print("\n\n--- Research Process Concluded ---")
+
+    if not all_research_data and (not final_answer or "No research data was collected" in final_answer):
+        print("😔 The research process did not yield any data or a substantive final answer.")
+        print("   This might be due to: restrictive search results, inability to scrape content,")
+        print("   or the initial query being too niche or broad for effective automated research.")
+    else:
+        # Even if all_research_data is empty, final_answer might have a generic message.
+        # Always try to save what we have.
+        save_research_to_markdown(query, final_answer, all_research_data, filename_prefix=output)
+        if not all_research_data:
+             print("\nNote: While a final answer (or message) was generated, no detailed intermediate research steps were recorded.")
+
+
 # --- CLI Definition using Click ---
 @click.command()
 @click.option(
@@ -91,7 +111,19 @@ def save_research_to_markdown(initial_query: str, final_answer: str, all_researc
     show_default=True,
     help="Prefix for the output markdown filename."
 )
-def cli_main(query: str, depth: int, output: str):
+@click.option(
+    '--deadline',
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Wall-clock budget in seconds. Research is scaled down and synthesis starts early to finish within it."
+)
+@click.option(
+    '--max-cost',
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Estimated spend limit in USD (LLM tokens + search calls) for the whole run."
+)
+def cli_main(query: str, depth: int, output: str, deadline: float | None, max_cost: float | None):
     """
     Deep Research Tool - Python Version
 
@@ -104,6 +136,10 @@ def cli_main(query: str, depth: int, output: str):
     print(f"   Query: \"{query}\"")
     print(f"   Max Depth: {depth}")
     print(f"   Output File Prefix: {output}")
+    if deadline is not None:
+        print(f"   Deadline: {deadline:g}s")
+    if max_cost is not None:
+        print(f"   Max Cost: ${max_cost:g}")
     
     # Check for OpenAI API Key early
     openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -116,20 +152,9 @@ def cli_main(query: str, depth: int, output: str):
         return # Exit if key is missing
 
     print("\n⏳ Starting research process...\n")
-    final_answer, all_research_data = run_deep_research(query, depth)
-
-    print("\n\n--- Research Process Concluded ---")
-
-    if not all_research_data and (not final_answer or "No research data was collected" in final_answer):
-        print("😔 The research process did not yield any data or a substantive final answer.")
-        print("   This might be due to: restrictive search results, inability to scrape content,")
-        print("   or the initial query being too niche or broad for effective automated research.")
-    else:
-        # Even if all_research_data is empty, final_answer might have a generic message.
-        # Always try to save what we have.
-        save_research_to_markdown(query, final_answer, all_research_data, filename_prefix=output)
-        if not all_research_data:
-             print("\nNote: While a final answer (or message) was generated, no detailed intermediate research steps were recorded.")
+    final_answer, all_research_data = run_deep_research(query, depth, deadline_seconds=deadline, max_cost_usd=max_cost)
+    with all_research_data: # Closes (and cleans up) the on-disk content store when done
+        report_research_results(query, final_answer, all_research_data, output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from search_utils import search_web
+from scraper_utils import fetch_and_extract_content, fetch_html_and_extract_content
+from relevance_utils import rank_search_results
+
+# --- Speculative prefetching of searches and page fetches ---
+# The research loop is otherwise stop-and-wait: the browser idles while the LLM analyzes
+# and the LLM idles while the next search/fetch runs. The prefetcher runs searches and
+# fetches on background threads so they overlap with LLM calls; the research loop then
+# picks up the finished (or in-flight) result instead of starting the work itself.
+
+
+class Prefetcher:
+    """
+    Caches in-flight search and fetch futures, keyed by query and URL.
+    Results are handed out once and then dropped. Speculative fetches that turn out not to be needed
+    (e.g. backups for a page that succeeded) stay cached until the caller drops them with `discard`,
+    so callers should discard unused backups once a source is processed to keep memory flat.
+    With max_workers=0 every call runs synchronously and nothing is prefetched.
+    If keep_html is False, raw HTML is discarded right after extraction instead of being held until consumed.
+    """
+
+    def __init__(self, max_workers: int = 2, keep_html: bool = False):
+        self.enabled = max_workers > 0
+        self.keep_html = keep_html
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch") if self.enabled else None
+        self._lock = threading.Lock()
+        self._searches: dict[str, tuple[int, Future]] = {} # query -> (max_results requested, future)
+        self._fetches: dict[str, Future] = {}
+
+    # --- Speculative work ---
+    def prefetch_content(self, url: str):
+        """Starts fetching and extracting `url` in the background if it isn't already pending."""
+        if not self.enabled or not url:
+            return
+        with self._lock:
+            if url in self._fetches:
+                return
+            print(f"🔮 Prefetching content in background: {url}")
+            self._fetches[url] = self._executor.submit(self._fetch_now, url)
+
+    def prefetch_search(self, query: str, max_results: int, warm_fetches: int = 0, skip_urls: set | None = None):
+        """
+        Starts a background search for `query`; once it returns, warms fetches for the
+        top `warm_fetches` ranked results that are not in `skip_urls`.
+        """
+        if not self.enabled or not query:
+            return
+        with self._lock:
+            if query in self._searches:
+                return
+            print(f"🔮 Prefetching search in background: \"{query}\"")
+            self._searches[query] = (max_results, self._executor.submit(self._search_and_warm, query, max_results, warm_fetches, skip_urls))
+
+    def _search_and_warm(self, query: str, max_results: int, warm_fetches: int, skip_urls: set | None):
+        results = search_web(query, max_results=max_results)
+        if warm_fetches and results:
+            warmed = 0
+            for result in rank_search_results(query, results):
+                url = result.get('href')
+                if not url or (skip_urls is not None and url in skip_urls):
+                    continue
+                self.prefetch_content(url)
+                warmed += 1
+                if warmed >= warm_fetches:
+                    break
+        return results
+
+    def discard(self, urls):
+        """Drops pending fetches for `urls`, cancelling them if they haven't started yet."""
+        if not self.enabled:
+            return
+        with self._lock:
+            futures = [self._fetches.pop(url, None) for url in urls]
+        for future in futures:
+            if future is not None:
+                future.cancel()
+
+    # --- Consumption (blocking) ---
+    def search(self, query: str, max_results: int) -> list:
+        """Returns search results, waiting on a prefetched search if one is pending and asked for enough results."""
+        with self._lock:
+            prefetched_max_results, future = self._searches.pop(query, (0, None))
+        if future is not None and prefetched_max_results >= max_results:
+            try:
+                return future.result()[:max_results]
+            except Exception as e:
+                print(f"⚠️ Prefetched search for \"{query}\" failed ({e}). Searching again.")
+        return search_web(query, max_results=max_results)
+
+    def _fetch_now(self, url: str) -> tuple[str | None, str | None]:
+        if self.keep_html:
+            return fetch_html_and_extract_content(url)
+        return fetch_and_extract_content(url), None
+
+    def fetch(self, url: str) -> tuple[str | None, str | None]:
+        """
+        Returns (extracted_text, raw_html) for `url`, waiting on a prefetched fetch if one is pending.
+        raw_html is always None unless the prefetcher was created with keep_html=True.
+        """
+        with self._lock:
+            future = self._fetches.pop(url, None)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"⚠️ Prefetched fetch for {url} failed ({e}). Fetching again.")
+        return self._fetch_now(url)
+
+    def shutdown(self):
+        """Cancels queued speculative work and drops unconsumed results. Running fetches finish in the background."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._searches.clear()
+            self._fetches.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
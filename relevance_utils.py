@@ -0,0 +1,155 @@
+import re
+from collections import Counter
+import numpy as np
+
+# --- Local (CPU-only) relevance scoring ---
+# Used to rank search results by their snippets before fetching, and to reject
+# scraped pages that are clearly off-topic before paying for an LLM analysis call.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# How much the search engine's own ordering still counts when re-ranking by snippet score
+RANK_PRIOR_WEIGHT = 0.5
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i in is it its of on or that the this to
+was were what when where which who why will with about into than then there these those
+do does did can could should would you your we our they their he she his her not no yes
+""".split())
+
+# Pages that are mostly one of these are login walls / cookie notices rather than content
+_BOILERPLATE_RE = re.compile(
+    r"(accept (all )?cookies|cookie (policy|settings|preferences)|enable javascript|"
+    r"sign in to continue|log ?in to continue|please (log|sign) ?in|subscribe to (continue|read)|"
+    r"access denied|are you a robot|verify you are human|captcha)",
+    re.IGNORECASE
+)
+BOILERPLATE_MAX_CHARS = 1500 # Only short pages are rejected as boilerplate
+
+# Scripts written without spaces between words (Chinese, Japanese kana, Thai, Lao, Myanmar, Khmer):
+# \w+ reads a whole phrase as one token, so such terms can't be matched against page text
+_UNSPACED_SCRIPT_RE = re.compile(r"[\u0e00-\u0eff\u1000-\u109f\u1780-\u17ff\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases and splits text into word tokens, dropping stopwords and 1-char tokens."""
+    if not text:
+        return []
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def scorable_terms(query: str) -> list[str]:
+    """Distinct query tokens that can be matched word-by-word against text (see tokenize)."""
+    return [t for t in dict.fromkeys(tokenize(query)) if not _UNSPACED_SCRIPT_RE.search(t)]
+
+
+def bm25_scores(query: str, documents: list[str]) -> np.ndarray:
+    """
+    Scores each document against the query with Okapi BM25, using the documents themselves as the corpus.
+    Only query terms are counted, so the term-frequency matrix is (n_docs x n_query_terms).
+
+    Returns:
+        np.ndarray: One float score per document (all zeros if the query has no usable terms).
+    """
+    query_terms = list(dict.fromkeys(tokenize(query)))
+    if not documents or not query_terms:
+        return np.zeros(len(documents), dtype=float)
+
+    doc_tokens = [tokenize(doc) for doc in documents]
+    doc_lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=float)
+    counts = [Counter(tokens) for tokens in doc_tokens]
+    tf = np.array([[c[term] for term in query_terms] for c in counts], dtype=float)
+
+    n_docs = len(documents)
+    doc_freq = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    avg_len = doc_lengths.mean() if doc_lengths.mean() > 0 else 1.0
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / avg_len)
+    term_scores = tf * (BM25_K1 + 1) / (tf + length_norm[:, None])
+    return term_scores @ idf
+
+
+def rank_search_results(query: str, search_results: list[dict]) -> list[dict]:
+    """
+    Re-orders search results by BM25 relevance of their title + snippet ('body') to the query,
+    blended with the engine's original rank so ties and empty snippets keep their position.
+    """
+    if len(search_results) < 2:
+        return list(search_results)
+
+    documents = [f"{r.get('title') or ''} {r.get('body') or ''}" for r in search_results]
+    scores = bm25_scores(query, documents)
+    max_score = scores.max()
+    if max_score > 0:
+        scores = scores / max_score
+    rank_prior = RANK_PRIOR_WEIGHT / (1 + np.arange(len(search_results)))
+    order = np.argsort(-(scores + rank_prior), kind="stable")
+    return [search_results[i] for i in order]
+
+
+def content_relevance_score(query: str, content: str, require_all_terms: bool = False) -> float:
+    """
+    Scores extracted page text against the query in [0, 1]: the mean over query terms of the
+    BM25-saturated term frequency tf * (k1 + 1) / (tf + k1), scaled so ~3 mentions count as fully present.
+    A page that never mentions any query term scores 0.
+
+    With require_all_terms, the minimum over query terms is used instead of the mean, so the text
+    scores 0 unless it mentions every (non-stopword) query term.
+    """
+    query_terms = scorable_terms(query)
+    if not query_terms or not content:
+        return 0.0
+    counts = Counter(tokenize(content))
+    tf = np.array([counts[term] for term in query_terms], dtype=float)
+    saturated = np.minimum(tf * (BM25_K1 + 1) / (tf + BM25_K1) / 1.5, 1.0)
+    return float(saturated.min() if require_all_terms else saturated.mean())
+
+
+def is_relevant_content(query: str, content: str, min_score: float) -> tuple[bool, float]:
+    """
+    Decides whether scraped content is worth sending to the LLM.
+
+    Returns:
+        tuple: (is_relevant, score). Short login-wall / cookie-notice pages are rejected with score 0.
+               If the query has no scorable terms (only stopwords, or a script written without spaces)
+               the relevance filter is skipped and any non-boilerplate page passes with score 1.
+    """
+    if len(content) <= BOILERPLATE_MAX_CHARS and _BOILERPLATE_RE.search(content):
+        return False, 0.0
+    if not scorable_terms(query):
+        return True, 1.0
+    score = content_relevance_score(query, content)
+    return score >= min_score, score
+
+
+if __name__ == '__main__':
+    print("--- Testing relevance_utils.py ---")
+    test_query = "quantum error correction surface codes"
+    test_results = [
+        {'title': 'Login', 'href': 'https://example.com/login', 'body': 'Sign in to your account'},
+        {'title': 'Surface codes explained', 'href': 'https://example.com/surface', 'body': 'Surface codes are the leading approach to quantum error correction.'},
+        {'title': 'Quantum computing news', 'href': 'https://example.com/news', 'body': 'Latest quantum hardware announcements.'},
+    ]
+    print("\nRanked search results:")
+    for r in rank_search_results(test_query, test_results):
+        print(f"  {r['title']} -> {r['href']}")
+
+    print("\nContent relevance:")
+    for text in [
+        "We use cookies. Accept all cookies to continue.",
+        "Surface codes protect logical qubits; quantum error correction thresholds are improving.",
+        "A recipe for banana bread with walnuts.",
+    ]:
+        ok, score = is_relevant_content(test_query, text, min_score=0.15)
+        print(f"  relevant={ok} score={score:.2f} :: {text[:60]}")
+
+    print("\nQueries without scorable terms (filter skipped, boilerplate still rejected):")
+    for unscorable_query, text in [
+        ("What is it?", "Surface codes protect logical qubits."),
+        ("量子纠错的最新进展", "量子纠错是量子计算的关键技术，表面码取得了新进展。"),
+        ("量子纠错的最新进展", "We use cookies. Accept all cookies to continue."),
+    ]:
+        ok, score = is_relevant_content(unscorable_query, text, min_score=0.15)
+        print(f"  relevant={ok} score={score:.2f} :: \"{unscorable_query}\" / {text[:40]}")
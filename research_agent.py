@@ -1,10 +1,15 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Import our utility modules
-from llm_utils import get_llm_response, analyze_content_prompt, refine_answer_prompt, parse_llm_analysis_response
-from search_utils import search_web
-from scraper_utils import fetch_and_extract_content # This will use the aliased scraper
+from llm_utils import get_llm_response, get_llm_analysis, analyze_content_prompt, extract_notes_prompt, refine_answer_prompt
+from prefetch_utils import Prefetcher # Wraps search_web / fetch_and_extract_content with background prefetching
+from research_store import ResearchStore
+from knowledge_index import KnowledgeIndex
+from budget_utils import RunBudget
+from relevance_utils import rank_search_results, is_relevant_content
+from chunk_utils import count_tokens, select_relevant_chunks, group_relevant_chunks
 
 # Load environment variables (e.g., for MAX_SEARCH_RESULTS_PER_QUERY if set in .env)
 load_dotenv()
@@ -13,6 +18,66 @@ load_dotenv()
 # MAX_SEARCH_RESULTS_PER_QUERY: How many search results to fetch initially for each query.
 # The agent will iterate through these and process the *first* suitable one.
 MAX_SEARCH_RESULTS_TO_FETCH = int(os.getenv("MAX_SEARCH_RESULTS_PER_QUERY", 5))
+# MAX_BREADTH: How many of the LLM's suggested sub-queries to follow from each source (1 mirrors the Go project).
+MAX_BREADTH = int(os.getenv("MAX_BREADTH", 1))
+# RELEVANCE_MIN_SCORE: Scraped pages scoring below this (0-1, local query-term score) are skipped without an LLM call.
+RELEVANCE_MIN_SCORE = float(os.getenv("RELEVANCE_MIN_SCORE", 0.15))
+# CONTENT_TOKEN_BUDGET: Max tokens of page content sent to the analysis prompt; longer pages are cut down to their most relevant chunks.
+CONTENT_TOKEN_BUDGET = int(os.getenv("CONTENT_TOKEN_BUDGET", 3000))
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 300))
+# MAP_PASS_MIN_TOKENS: Pages longer than this get an LLM "map" pass over MAP_PASS_MAX_SECTIONS sections (0 disables it).
+MAP_PASS_MIN_TOKENS = int(os.getenv("MAP_PASS_MIN_TOKENS", 0))
+MAP_PASS_MAX_SECTIONS = int(os.getenv("MAP_PASS_MAX_SECTIONS", 3))
+# PREFETCH_WORKERS: Background threads for speculative searches/fetches while the LLM is busy (0 disables prefetching).
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+# PREFETCH_RESULTS: How many backup / next-query search results to fetch ahead of time.
+PREFETCH_RESULTS = int(os.getenv("PREFETCH_RESULTS", 1))
+# RESEARCH_BLOB_DIR: If set, full extracted content (and raw HTML if KEEP_RAW_HTML=true) is kept there for audits.
+RESEARCH_BLOB_DIR = os.getenv("RESEARCH_BLOB_DIR") or None
+KEEP_RAW_HTML = os.getenv("KEEP_RAW_HTML", "false").strip().lower() in ("1", "true", "yes")
+# KNOWLEDGE_INDEX_PATH: SQLite file of findings from past runs, consulted before searching the web (empty disables it).
+KNOWLEDGE_INDEX_PATH = os.getenv("KNOWLEDGE_INDEX_PATH", "knowledge_index.sqlite3")
+# KNOWLEDGE_MAX_AGE_DAYS / KNOWLEDGE_MIN_SCORE: How fresh and how well it covers every query term (0-1) a prior finding must be to be reused.
+KNOWLEDGE_MAX_AGE_DAYS = float(os.getenv("KNOWLEDGE_MAX_AGE_DAYS", 7))
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", 0.6))
+
+# --- Content Preparation ---
+def prepare_content_for_analysis(
+    current_query: str,
+    content: str,
+    url: str,
+    token_budget: int = CONTENT_TOKEN_BUDGET,
+    allow_map_pass: bool = True
+) -> str:
+    """
+    Reduces scraped content to what the analysis prompt needs.
+    - Content within token_budget (default CONTENT_TOKEN_BUDGET) is passed through unchanged.
+    - Longer content is cut down to its most query-relevant chunks (local BM25 scoring).
+    - Very long content (over MAP_PASS_MIN_TOKENS, if enabled) is condensed section by section
+      by the LLM in parallel, and the resulting notes are analyzed instead.
+    """
+    content_tokens = count_tokens(content)
+    if content_tokens <= token_budget:
+        return content
+
+    if allow_map_pass and MAP_PASS_MIN_TOKENS and content_tokens > MAP_PASS_MIN_TOKENS:
+        sections = group_relevant_chunks(current_query, content, token_budget, MAP_PASS_MAX_SECTIONS, CHUNK_TOKENS)
+        if len(sections) > 1:
+            print(f"🗺️ Long source ({content_tokens} tokens). Running map pass over {len(sections)} sections...")
+            prompts = [
+                extract_notes_prompt(current_query, section, url, i + 1, len(sections))
+                for i, section in enumerate(sections)
+            ]
+            with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+                notes = list(executor.map(get_llm_response, prompts))
+            notes = [n.strip() for n in notes if n and n.strip()]
+            if notes:
+                return "\n\n".join(f"Notes from section {i + 1}:\n{n}" for i, n in enumerate(notes))
+            print("⚠️ Map pass produced no notes. Falling back to chunk selection.")
+
+    selected = select_relevant_chunks(current_query, content, token_budget, CHUNK_TOKENS)
+    print(f"✂️ Long source ({content_tokens} tokens). Sending {count_tokens(selected)} tokens of the most relevant chunks.")
+    return selected
 
 # --- Recursive Research Step Function ---
 def conduct_research_step(
@@ -20,35 +85,75 @@ def conduct_research_step(
     current_depth: int,
     max_depth: int,
     visited_urls: set,
-    all_research_data: list
+    all_research_data: ResearchStore,
+    prefetcher: Prefetcher | None = None,
+    knowledge_index: KnowledgeIndex | None = None,
+    budget: RunBudget | None = None
 ):
     """
     Performs one step of the recursive research process.
-    - Searches for the current_query.
+    - Reuses a fresh, relevant finding from the knowledge index if there is one (no search/scrape/LLM).
+    - Otherwise searches for the current_query.
     - Processes the *first* unvisited, scrapable, and analyzable search result.
     - Stores findings.
-    - If a new query is generated by the LLM, recursively calls itself for that new query.
+    - If new queries are generated by the LLM, recursively calls itself for the first one(s).
 
     Args:
         current_query (str): The query for this research step.
         current_depth (int): The current depth of recursion.
         max_depth (int): The maximum allowed recursion depth.
         visited_urls (set): A set of URLs already processed to avoid redundant work.
-        all_research_data (list): A list accumulating dictionaries of findings from each step.
+        all_research_data (ResearchStore): Store accumulating a record of findings from each step.
+        prefetcher (Prefetcher, optional): Runs searches/fetches ahead of time so they overlap with LLM calls.
+                                           If omitted, everything runs synchronously.
+        knowledge_index (KnowledgeIndex, optional): Findings from past runs; consulted first and updated with new findings.
+        budget (RunBudget, optional): Deadline/cost tracker that scales the step's work and stops research early.
+                                      If omitted, the run is unlimited.
     """
     if current_depth > max_depth:
         print(f"ℹ️ Max depth ({max_depth}) reached. Halting research for query: \"{current_query}\"")
         return
 
+    if budget is None:
+        budget = RunBudget()
+    if budget.should_stop():
+        print(f"⏳ Run budget nearly exhausted ({budget.describe()}). Skipping query: \"{current_query}\"")
+        return
+
     print(f"\n➡️ Depth {current_depth} | Query: \"{current_query}\"")
 
-    search_results = search_web(current_query, max_results=MAX_SEARCH_RESULTS_TO_FETCH)
+    if prefetcher is None:
+        prefetcher = Prefetcher(max_workers=0)
+
+    if knowledge_index is not None:
+        prior_hits = knowledge_index.lookup(current_query, exclude_urls=visited_urls)
+        if prior_hits:
+            hit = prior_hits[0]
+            visited_urls.add(hit.url)
+            print(f"📚 Reusing prior finding from knowledge index: {hit.url} (relevance {hit.score:.2f}, originally for \"{hit.query}\")")
+            all_research_data.add(
+                depth=current_depth,
+                query=current_query,
+                url=hit.url,
+                title=hit.title,
+                summary=hit.summary,
+                generated_queries=list(hit.generated_queries),
+                from_index=True
+            )
+            pursue_sub_queries(list(hit.generated_queries), current_depth, max_depth, visited_urls, all_research_data, prefetcher, knowledge_index, budget)
+            return
+
+    search_results = prefetcher.search(current_query, max_results=budget.search_results_to_try(MAX_SEARCH_RESULTS_TO_FETCH))
     if not search_results:
         print(f"⚠️ No search results found for \"{current_query}\". Halting this research path.")
         return
 
+    # Try the results whose title/snippet best match the query first
+    search_results = rank_search_results(current_query, search_results)
+
     processed_one_url_successfully_this_step = False
-    for search_result in search_results:
+    queued_backup_urls = [] # Backups prefetched this step; dropped once no longer needed
+    for result_index, search_result in enumerate(search_results):
         url = search_result.get('href')
         title = search_result.get('title', 'N/A')
 
@@ -59,31 +164,55 @@ def conduct_research_step(
         if url in visited_urls:
             print(f"⏭️ Skipping already visited URL: {url}")
             continue
+
+        if budget.should_stop():
+            print(f"⏳ Run budget nearly exhausted ({budget.describe()}). Not trying further results for \"{current_query}\".")
+            break
         
         # Mark as visited *before* attempting to process, to handle retries or concurrent scenarios better (though this is serial)
         visited_urls.add(url) 
         
+        # Queue the next results before fetching this one, so a backup is already loading
+        # if this page turns out unscrapable, off-topic or unanalyzable
+        backup_urls = [
+            r.get('href') for r in search_results[result_index + 1:]
+            if r.get('href') and r.get('href') not in visited_urls
+        ]
+        for backup_url in backup_urls[:PREFETCH_RESULTS]:
+            prefetcher.prefetch_content(backup_url)
+            queued_backup_urls.append(backup_url)
+
         print(f"🧐 Processing URL: {url} (Title: {title})")
-        content = fetch_and_extract_content(url) # Uses the chosen scraper from scraper_utils
+        content, raw_html = prefetcher.fetch(url) # Uses the chosen scraper from scraper_utils (or its prefetched result)
         
         if content:
-            # Successfully scraped content, now analyze with LLM
+            is_relevant, relevance_score = is_relevant_content(current_query, content, RELEVANCE_MIN_SCORE)
+            if not is_relevant:
+                print(f"🚫 Content from {url} looks off-topic (relevance {relevance_score:.2f} < {RELEVANCE_MIN_SCORE}). Skipping LLM analysis.")
+                continue
+
+            # Successfully scraped relevant content, now analyze with LLM
             print(f"🤖 Content scraped. Analyzing with LLM for query: \"{current_query}\"...")
 
             # Build context from previous summaries (mirrors Go project logic)
-            context_parts = [item['summary'] for item in all_research_data if item.get('summary')]
+            context_parts = list(all_research_data.summaries())
             research_so_far_context = "\n\n---\n\n".join(context_parts) if context_parts else ""
 
             prompt_for_analysis = analyze_content_prompt(
                 current_query=current_query,
-                content_from_url=content, # Pass full content
+                content_from_url=prepare_content_for_analysis( # Only the relevant parts of long pages
+                    current_query, content, url,
+                    token_budget=budget.content_token_budget(CONTENT_TOKEN_BUDGET),
+                    allow_map_pass=budget.allow_map_pass()
+                ),
                 source_url=url,
                 research_so_far_context=research_so_far_context
             )
-            llm_analysis_raw = get_llm_response(prompt_for_analysis)
+            # Structured-output call; parsing, local JSON repair and re-ask happen inside
+            llm_analysis = get_llm_analysis(prompt_for_analysis)
 
-            if llm_analysis_raw:
-                summary, new_sub_queries = parse_llm_analysis_response(llm_analysis_raw)
+            if llm_analysis:
+                summary, new_sub_queries = llm_analysis
                 
                 print(f"📝 LLM Summary for {url}: \"{summary[:150].strip()}...\"")
                 if new_sub_queries:
@@ -92,31 +221,24 @@ def conduct_research_step(
                     print(f"💡 LLM suggested no new queries from this content.")
 
                 # Store this step's findings
-                all_research_data.append({
-                    "depth": current_depth,
-                    "query": current_query,
-                    "url": url,
-                    "title": title,
-                    "summary": summary,
-                    "generated_queries": new_sub_queries, # Store all for record
-                    "raw_content_snippet": content[:250] + "..." # For reference in output file
-                })
+                all_research_data.add(
+                    depth=current_depth,
+                    query=current_query,
+                    url=url,
+                    title=title,
+                    summary=summary,
+                    generated_queries=new_sub_queries, # Store all for record
+                    content=content, # Spilled to the compressed blob file, not kept in memory
+                    raw_html=raw_html
+                )
+                if knowledge_index is not None and summary:
+                    knowledge_index.add_finding(url, title, current_query, summary, new_sub_queries, content)
                 
                 processed_one_url_successfully_this_step = True
+                budget.record_step()
+                prefetcher.discard(queued_backup_urls) # Free unused backups before recursing
 
-                # If new queries are generated, recurse with the FIRST one (mirrors Go project)
-                if new_sub_queries and new_sub_queries[0].strip(): # Check if first query is not empty
-                    next_query = new_sub_queries[0].strip()
-                    print(f"↳ Diving deeper with new query: \"{next_query}\"")
-                    conduct_research_step(
-                        next_query,
-                        current_depth + 1,
-                        max_depth,
-                        visited_urls,
-                        all_research_data
-                    )
-                else:
-                    print(f"↳ No valid new query to pursue from this path. Halting this branch.")
+                pursue_sub_queries(new_sub_queries, current_depth, max_depth, visited_urls, all_research_data, prefetcher, knowledge_index, budget)
                 
                 # CRITICAL: Processed one URL successfully, break from search_results loop
                 # This mirrors the Go project's behavior of processing only one source per step.
@@ -129,41 +251,131 @@ def conduct_research_step(
             # Do not break, allow trying the next search result if scraping fails.
     
     if not processed_one_url_successfully_this_step:
+        prefetcher.discard(queued_backup_urls)
         print(f"ℹ️ No processable content found for query \"{current_query}\" at depth {current_depth} after checking available search results. Halting this research path.")
 
+def pursue_sub_queries(
+    new_sub_queries: list,
+    current_depth: int,
+    max_depth: int,
+    visited_urls: set,
+    all_research_data: ResearchStore,
+    prefetcher: Prefetcher,
+    knowledge_index: KnowledgeIndex | None,
+    budget: RunBudget
+):
+    """
+    If new queries were generated, recurses with the first one (mirrors Go project), or the first
+    MAX_BREADTH ones, scaled down by the run budget. Stops recursing once another step is unaffordable.
+    Searches for all of them start in the background first, so later siblings overlap the first subtree.
+    """
+    next_queries = [q.strip() for q in new_sub_queries if q.strip()][:budget.breadth(MAX_BREADTH)]
+    if not next_queries:
+        print(f"↳ No valid new query to pursue from this path. Halting this branch.")
+        return
+
+    if current_depth < max_depth and budget.can_afford_step():
+        for next_query in next_queries:
+            if knowledge_index is not None and knowledge_index.lookup(next_query, exclude_urls=visited_urls):
+                continue # The index will answer this one without a search
+            prefetcher.prefetch_search(
+                next_query,
+                MAX_SEARCH_RESULTS_TO_FETCH,
+                warm_fetches=PREFETCH_RESULTS,
+                skip_urls=visited_urls
+            )
+
+    for next_query in next_queries:
+        if current_depth < max_depth and not budget.can_afford_step():
+            print(f"⏳ Not enough run budget left for another step ({budget.describe()}). Halting this branch.")
+            return
+        print(f"↳ Diving deeper with new query: \"{next_query}\"")
+        conduct_research_step(
+            next_query,
+            current_depth + 1,
+            max_depth,
+            visited_urls,
+            all_research_data,
+            prefetcher,
+            knowledge_index,
+            budget
+        )
+
+def open_knowledge_index() -> KnowledgeIndex | None:
+    """Opens the cross-run knowledge index at KNOWLEDGE_INDEX_PATH, or returns None if disabled/unavailable."""
+    if not KNOWLEDGE_INDEX_PATH:
+        return None
+    try:
+        knowledge_index = KnowledgeIndex(KNOWLEDGE_INDEX_PATH, max_age_days=KNOWLEDGE_MAX_AGE_DAYS, min_score=KNOWLEDGE_MIN_SCORE, chunk_tokens=CHUNK_TOKENS)
+        print(f"📚 Knowledge index: {KNOWLEDGE_INDEX_PATH} ({len(knowledge_index)} prior sources)")
+        return knowledge_index
+    except Exception as e:
+        print(f"⚠️ Could not open knowledge index at {KNOWLEDGE_INDEX_PATH} ({e}). Continuing without it.")
+        return None
+
 # --- Main Orchestration Function ---
-def run_deep_research(initial_query: str, max_depth: int):
+def run_deep_research(initial_query: str, max_depth: int, deadline_seconds: float | None = None, max_cost_usd: float | None = None):
     """
     Main function to orchestrate the entire deep research process.
 
     Args:
         initial_query (str): The starting research query.
         max_depth (int): The maximum depth for the research.
+        deadline_seconds (float, optional): Wall-clock budget for the whole run, including synthesis.
+        max_cost_usd (float, optional): Estimated spend limit (LLM tokens + search calls) for the whole run.
 
     Returns:
-        tuple: (final_answer_string, list_of_all_research_data_dicts)
+        tuple: (final_answer_string, ResearchStore of all research records).
+               The caller should close() the store once it is done reading it.
     """
     visited_urls = set()    # To keep track of URLs we've already processed
-    all_research_data = []  # To store data from each step (dict per step)
+    all_research_data = ResearchStore(blob_dir=RESEARCH_BLOB_DIR, keep_raw_html=KEEP_RAW_HTML) # One record per step
+
+    try:
+        return _research_and_synthesize(initial_query, max_depth, visited_urls, all_research_data, deadline_seconds, max_cost_usd)
+    except BaseException:
+        all_research_data.close() # The caller never receives the store, so clean up its blob file here
+        raise
+
+def _research_and_synthesize(
+    initial_query: str,
+    max_depth: int,
+    visited_urls: set,
+    all_research_data: ResearchStore,
+    deadline_seconds: float | None,
+    max_cost_usd: float | None
+):
+    """Body of run_deep_research once the research store exists."""
+    prefetcher = Prefetcher(max_workers=PREFETCH_WORKERS, keep_html=KEEP_RAW_HTML)
+    knowledge_index = open_knowledge_index()
+    budget = RunBudget(deadline_seconds=deadline_seconds, max_cost_usd=max_cost_usd)
 
     # Start the recursive research process
-    conduct_research_step(
-        current_query=initial_query,
-        current_depth=1, # Start at depth 1
-        max_depth=max_depth,
-        visited_urls=visited_urls,
-        all_research_data=all_research_data
-    )
+    try:
+        conduct_research_step(
+            current_query=initial_query,
+            current_depth=1, # Start at depth 1
+            max_depth=max_depth,
+            visited_urls=visited_urls,
+            all_research_data=all_research_data,
+            prefetcher=prefetcher,
+            knowledge_index=knowledge_index,
+            budget=budget
+        )
+    finally:
+        prefetcher.shutdown() # Drop any speculative work that wasn't needed
+        if knowledge_index is not None:
+            knowledge_index.close()
 
     # After all research steps are done, synthesize the final answer
     if not all_research_data:
         print("😔 No research data was gathered. Cannot generate final answer.")
         return "No research data was collected, so no final answer could be synthesized.", all_research_data
 
-    print("\n🏁 Research phase complete. Synthesizing Final Answer from all findings...")
+    print(f"\n🏁 Research phase complete ({budget.describe()}). Synthesizing Final Answer from all findings...")
     
     # Build context for final refinement (concatenation of all summaries)
-    final_context_parts = [item['summary'] for item in all_research_data if item.get('summary')]
+    final_context_parts = list(all_research_data.summaries())
     if not final_context_parts:
         print("⚠️ No summaries collected during research. Final answer will be based on the initial query only or might be very generic.")
         final_research_context = "No specific summaries were extracted during the research process."
@@ -177,7 +389,7 @@ def run_deep_research(initial_query: str, max_depth: int):
         final_answer = "The LLM failed to generate a final synthesized answer based on the collected research."
         print(f"⚠️ {final_answer}")
     else:
-        print("✅ Final answer synthesized.")
+        print(f"✅ Final answer synthesized. Run totals: {budget.describe()}")
 
     return final_answer, all_research_data
 
@@ -202,12 +414,13 @@ if __name__ == '__main__':
         print("\n\nDETAILED RESEARCH STEPS RECORDED:")
         if research_summary:
             for i, step_data in enumerate(research_summary):
-                print(f"\n  Step {i+1} (Depth {step_data['depth']}):")
-                print(f"    Query: \"{step_data['query']}\"")
-                print(f"    URL: {step_data['url']}")
-                print(f"    Title: \"{step_data['title']}\"")
-                print(f"    Summary: \"{step_data['summary'][:100].strip()}...\"")
-                if step_data.get('generated_queries'):
-                    print(f"    Generated Queries: {step_data['generated_queries']}")
+                print(f"\n  Step {i+1} (Depth {step_data.depth}):")
+                print(f"    Query: \"{step_data.query}\"")
+                print(f"    URL: {step_data.url}")
+                print(f"    Title: \"{step_data.title}\"")
+                print(f"    Summary: \"{step_data.summary[:100].strip()}...\"")
+                if step_data.generated_queries:
+                    print(f"    Generated Queries: {list(step_data.generated_queries)}")
         else:
-            print("  No detailed research steps were recorded.")
\ No newline at end of file
+            print("  No detailed research steps were recorded.")
+        research_summary.close()
\ No newline at end of file
@@ -0,0 +1,178 @@
+import os
+import json
+import zlib
+import tempfile
+from dataclasses import dataclass, asdict
+from typing import Iterator
+
+# --- Memory-bounded storage for research findings ---
+# Each processed source becomes a compact ResearchRecord kept in memory (metadata + LLM summary).
+# Bulky data (full extracted text, raw HTML) is zlib-compressed and appended to an on-disk blob
+# file; records only hold (offset, length) pointers into it, so memory stays flat as runs grow.
+
+
+@dataclass(slots=True)
+class BlobRef:
+    """Location of one compressed blob inside the store's blob file."""
+    offset: int
+    length: int
+
+
+@dataclass(slots=True)
+class ResearchRecord:
+    """Findings from one research step (one processed source)."""
+    depth: int
+    query: str
+    url: str
+    title: str
+    summary: str
+    generated_queries: tuple[str, ...] = ()
+    content_ref: BlobRef | None = None
+    raw_html_ref: BlobRef | None = None
+    from_index: bool = False # Reused from the cross-run knowledge index rather than fetched this run
+
+
+class ResearchStore:
+    """
+    Append-only store of ResearchRecords with content spilled to a compressed blob file.
+
+    Iterating yields records in insertion order; `get_content` / `get_raw_html` read a record's
+    blobs back from disk on demand.
+
+    Content is only written to disk when something will read it: if `blob_dir` is given, the blob file
+    and a JSON-lines index of the records are kept there for audits; otherwise content is dropped unless
+    `keep_content` (or `keep_raw_html`) asks for it, in which case a temporary blob file is used and
+    removed on `close()`. With nothing to keep, no blob file is created at all.
+    """
+
+    def __init__(self, blob_dir: str | None = None, keep_raw_html: bool = False, keep_content: bool | None = None, compression_level: int = 6):
+        self.keep_raw_html = keep_raw_html
+        self.keep_content = bool(blob_dir) if keep_content is None else keep_content
+        self.compression_level = compression_level
+        self._records: list[ResearchRecord] = []
+        self._index_file = None
+        self._blob_file = None
+        self.blob_path = None
+        self._persistent = bool(blob_dir)
+        if blob_dir:
+            os.makedirs(blob_dir, exist_ok=True)
+            fd, self.blob_path = tempfile.mkstemp(prefix="research_", suffix=".blobs", dir=blob_dir)
+            self._index_file = open(f"{self.blob_path}.index.jsonl", "w", encoding="utf-8")
+        elif self.keep_content or self.keep_raw_html:
+            fd, self.blob_path = tempfile.mkstemp(prefix="research_", suffix=".blobs")
+        if self.blob_path:
+            self._blob_file = os.fdopen(fd, "w+b")
+        self._closed = False
+
+    # --- Writing ---
+    def _write_blob(self, text: str | None) -> BlobRef | None:
+        if not text or self._blob_file is None:
+            return None
+        data = zlib.compress(text.encode("utf-8"), self.compression_level)
+        self._blob_file.seek(0, os.SEEK_END)
+        offset = self._blob_file.tell()
+        self._blob_file.write(data)
+        return BlobRef(offset, len(data))
+
+    def add(
+        self,
+        depth: int,
+        query: str,
+        url: str,
+        title: str,
+        summary: str,
+        generated_queries: list[str] | None = None,
+        content: str | None = None,
+        raw_html: str | None = None,
+        from_index: bool = False
+    ) -> ResearchRecord:
+        """Stores one step's findings; `content` (if kept) and `raw_html` (if keep_raw_html) go to disk."""
+        record = ResearchRecord(
+            depth=depth,
+            query=query,
+            url=url,
+            title=title,
+            summary=summary,
+            generated_queries=tuple(generated_queries or ()),
+            content_ref=self._write_blob(content) if self.keep_content else None,
+            raw_html_ref=self._write_blob(raw_html) if self.keep_raw_html else None,
+            from_index=from_index,
+        )
+        self._records.append(record)
+        if self._index_file:
+            self._index_file.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+            self._index_file.flush()
+        return record
+
+    # --- Reading ---
+    def _read_blob(self, ref: BlobRef | None) -> str | None:
+        if ref is None:
+            return None
+        self._blob_file.flush()
+        self._blob_file.seek(ref.offset)
+        return zlib.decompress(self._blob_file.read(ref.length)).decode("utf-8")
+
+    def get_content(self, record: ResearchRecord) -> str | None:
+        """Returns the full extracted text stored for `record`, or None if none was stored."""
+        return self._read_blob(record.content_ref)
+
+    def get_raw_html(self, record: ResearchRecord) -> str | None:
+        """Returns the raw HTML stored for `record`, or None if raw HTML isn't being kept."""
+        return self._read_blob(record.raw_html_ref)
+
+    def summaries(self) -> Iterator[str]:
+        """Yields the non-empty LLM summaries in insertion order."""
+        return (record.summary for record in self._records if record.summary)
+
+    def __iter__(self) -> Iterator[ResearchRecord]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    # --- Lifecycle ---
+    def close(self):
+        """Closes the blob file; a temporary blob file is deleted, a persistent one is kept."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._index_file:
+            self._index_file.close()
+        if self._blob_file is None:
+            return
+        self._blob_file.close()
+        if not self._persistent:
+            try:
+                os.remove(self.blob_path)
+            except OSError as e:
+                print(f"⚠️ Could not remove temporary research blob file {self.blob_path}: {e}")
+        else:
+            print(f"🗄️ Research content kept for audit in: {self.blob_path} (index: {self.blob_path}.index.jsonl)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    print("--- Testing research_store.py ---")
+    with ResearchStore(keep_raw_html=True, keep_content=True) as store:
+        for i in range(3):
+            store.add(
+                depth=i + 1,
+                query=f"query {i}",
+                url=f"https://example.com/{i}",
+                title=f"Example {i}",
+                summary=f"Summary {i}",
+                generated_queries=[f"follow-up {i}"],
+                content=f"Full extracted text {i}. " * 200,
+                raw_html=f"<html><body>{'<p>page</p>' * 200}</body></html>",
+            )
+        print(f"Records stored: {len(store)}")
+        print(f"Blob file size on disk: {os.path.getsize(store.blob_path)} bytes")
+        for record in store:
+            content = store.get_content(record)
+            print(f"  {record.url}: content {len(content)} chars, html {len(store.get_raw_html(record))} chars")
+        print(f"Summaries: {list(store.summaries())}")
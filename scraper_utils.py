@@ -100,11 +100,14 @@ def extract_text_with_trafilatura(html_content: str, url: str = "") -> str | Non
         print(f"⚠️ Trafilatura extracted no main text from {url}.")
         return None
 
-# --- Main public function for the research agent ---
-def fetch_and_extract_content(url: str) -> str | None:
+# --- Main public functions for the research agent ---
+def fetch_html_and_extract_content(url: str) -> tuple[str | None, str | None]:
     """
     Fetches HTML from a URL using Playwright (for dynamic content)
     and then extracts text using Trafilatura.
+
+    Returns:
+        tuple: (extracted_text, raw_html). Either may be None.
     """
     # 1. Fetch with Playwright
     print(f"🚀 Starting Playwright fetch for: {url}")
@@ -113,10 +116,17 @@ def fetch_and_extract_content(url: str) -> str | None:
     if html_content:
         # 2. Extract with Trafilatura
         print(f"🔬 HTML fetched, proceeding to Trafilatura extraction for: {url}")
-        return extract_text_with_trafilatura(html_content, url)
+        return extract_text_with_trafilatura(html_content, url), html_content
     
     print(f"ℹ️ Failed to fetch HTML with Playwright for {url}. No content to extract.")
-    return None
+    return None, None
+
+
+def fetch_and_extract_content(url: str) -> str | None:
+    """
+    Same as fetch_html_and_extract_content, but returns only the extracted text.
+    """
+    return fetch_html_and_extract_content(url)[0]
 
 
 # --- Keep the old custom heuristic and requests-based fetch for comparison or fallback ---
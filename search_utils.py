@@ -1,5 +1,11 @@
 import os
-import time
+import math
+import threading
+import httplib2
+import requests
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from dotenv import load_dotenv
 from googleapiclient.discovery import build # For Google Search
 
@@ -8,77 +14,283 @@ load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
+# SEARXNG_URL: Base URL of a SearXNG (or compatible local index) instance, e.g. http://localhost:8888
+SEARXNG_URL = os.getenv("SEARXNG_URL")
+# SEARCH_BACKENDS: Comma-separated backends to fan out to; unconfigured ones are skipped.
+ENABLED_SEARCH_BACKENDS = [b.strip().lower() for b in os.getenv("SEARCH_BACKENDS", "google,searxng").split(",") if b.strip()]
+# SEARCH_BACKEND_TIMEOUT: Latency budget (seconds) for each backend request within one search.
+SEARCH_BACKEND_TIMEOUT = float(os.getenv("SEARCH_BACKEND_TIMEOUT", 8))
+RRF_K = 60 # Standard reciprocal-rank fusion constant
+
+# --- Usage Accounting ---
+# Running totals of backend requests and their estimated cost, across all threads.
+_usage_lock = threading.Lock()
+search_usage = {"calls": 0, "cost_usd": 0.0}
+
+def get_search_usage() -> dict:
+    """Returns a snapshot of the cumulative search request count and estimated cost."""
+    with _usage_lock:
+        return dict(search_usage)
+
+# --- Search Backends ---
+# Every backend returns result dicts shaped like {'title': ..., 'href': ..., 'body': ...}.
+# search_web fans a query out to all configured backends (and result pages) concurrently,
+# then merges the lists with reciprocal-rank fusion and URL de-duplication.
+
+class SearchBackend(ABC):
+    """Base class for a paged search backend."""
+    name = "base"
+    page_size = 10
+    cost_per_call = 0.0 # Estimated USD per request, used for run budgets
+
+    def is_configured(self) -> bool:
+        return True
+
+    def search(self, query: str, page: int, num_results: int) -> list:
+        """Records the request in search_usage, then runs search_page."""
+        with _usage_lock:
+            search_usage["calls"] += 1
+            search_usage["cost_usd"] += self.cost_per_call
+        return self.search_page(query, page, num_results)
+
+    @abstractmethod
+    def search_page(self, query: str, page: int, num_results: int) -> list:
+        """Returns up to `num_results` results for 1-based result page `page`."""
+
+
+class GoogleSearchBackend(SearchBackend):
+    """Google Custom Search API (max 10 results per request, first 100 results reachable)."""
+    name = "google"
+    page_size = 10
+    cost_per_call = float(os.getenv("GOOGLE_SEARCH_COST_PER_CALL", 0.005)) # $5 per 1000 queries beyond the free tier
+    max_start = 91 # CSE rejects start > 91 (i.e. beyond the first 100 results)
+
+    def __init__(self, timeout: float = 10):
+        self.timeout = timeout
+
+    def is_configured(self) -> bool:
+        return bool(GOOGLE_API_KEY and GOOGLE_CSE_ID)
+
+    def search_page(self, query: str, page: int, num_results: int) -> list:
+        start = (page - 1) * self.page_size + 1
+        if start > self.max_start:
+            return []
+        # Build a service object for interacting with the API; the HTTP timeout keeps a hung
+        # request from holding its thread (and interpreter exit) past the search budget
+        service = build("customsearch", "v1", developerKey=GOOGLE_API_KEY, http=httplib2.Http(timeout=self.timeout))
+        response = service.cse().list(
+            q=query,                # Search query
+            cx=GOOGLE_CSE_ID,       # Custom Search Engine ID
+            num=min(num_results, self.page_size),  # Number of results to return (1-10)
+            start=start             # 1-based index of the first result on this page
+            # You can add other parameters like 'lr' for language restrictions, etc.
+            # e.g., lr='lang_en'
+        ).execute()
+        return [
+            {
+                'title': item.get('title'),
+                'href': item.get('link'), # Google calls the URL 'link'
+                'body': item.get('snippet') # Google calls the snippet 'snippet'
+            }
+            for item in response.get('items', [])
+        ]
+
+
+class SearxngSearchBackend(SearchBackend):
+    """
+    SearXNG-compatible JSON search endpoint (a self-hosted metasearch instance or any local index
+    exposing GET /search?q=...&format=json&pageno=N with a 'results' list of {url, title, content}).
+    """
+    name = "searxng"
+    page_size = 10
+
+    def __init__(self, base_url: str | None, timeout: float = 10):
+        self.base_url = (base_url or "").rstrip("/")
+        self.timeout = timeout
+
+    def is_configured(self) -> bool:
+        return bool(self.base_url)
+
+    def search_page(self, query: str, page: int, num_results: int) -> list:
+        response = requests.get(
+            f"{self.base_url}/search",
+            params={'q': query, 'format': 'json', 'pageno': page},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return [
+            {'title': item.get('title'), 'href': item.get('url'), 'body': item.get('content')}
+            for item in response.json().get('results', [])[:num_results]
+        ]
+
+
+SEARCH_BACKENDS = {
+    "google": GoogleSearchBackend(timeout=SEARCH_BACKEND_TIMEOUT),
+    "searxng": SearxngSearchBackend(SEARXNG_URL, timeout=SEARCH_BACKEND_TIMEOUT),
+}
+
+
+def get_enabled_backends() -> list:
+    """Returns the configured backends listed in ENABLED_SEARCH_BACKENDS, in that order."""
+    return [
+        SEARCH_BACKENDS[name] for name in ENABLED_SEARCH_BACKENDS
+        if name in SEARCH_BACKENDS and SEARCH_BACKENDS[name].is_configured()
+    ]
+
+
+# --- Result Fusion ---
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for de-duplication: lowercase host, no fragment, tracking params or trailing slash."""
+    parts = urlsplit(url.strip())
+    query = urlencode([
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in ("fbclid", "gclid")
+    ])
+    netloc = parts.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path.rstrip("/"), query, ""))
+
+
+def reciprocal_rank_fusion(result_lists: list, max_results: int, k: int = RRF_K) -> list:
+    """
+    Merges ranked result lists with reciprocal-rank fusion (score = sum of 1 / (k + rank)),
+    collapsing results that point at the same normalized URL. The first-seen copy of a result is kept.
+    """
+    scores = {}
+    merged = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            href = result.get('href')
+            if not href:
+                continue
+            key = normalize_url(href)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            merged.setdefault(key, result)
+    ranked_keys = sorted(scores, key=scores.get, reverse=True) # Stable: ties keep first-seen order
+    return [merged[key] for key in ranked_keys[:max_results]]
+
+
+# --- Fan-out Search ---
+def search_web_fused(query: str, max_results: int = 5):
+    """
+    Searches all enabled backends concurrently, fetching as many result pages from each as
+    needed for `max_results`, and fuses the results.
+
+    Each backend request gets SEARCH_BACKEND_TIMEOUT seconds; anything slower is dropped from
+    this search (and left to finish in the background) so one slow backend can't stall the step.
+
+    Returns:
+        list: Fused result dictionaries {'title': ..., 'href': ..., 'body': ...}, or an empty list.
+    """
+    backends = get_enabled_backends()
+    print(f"🔎 Searching for: \"{query}\" (requesting up to {max_results} results from {[b.name for b in backends]})")
+    if not backends:
+        print("❌ No search backend is configured.")
+        print("   Set GOOGLE_API_KEY and GOOGLE_CSE_ID (and/or SEARXNG_URL) in your .env file.")
+        return []
+
+    tasks = []
+    for backend in backends:
+        pages = math.ceil(max_results / backend.page_size)
+        for page in range(1, pages + 1):
+            tasks.append((backend, page, min(backend.page_size, max_results - (page - 1) * backend.page_size)))
+
+    executor = ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="search")
+    futures = {executor.submit(backend.search, query, page, num): (backend, page) for backend, page, num in tasks}
+    done, not_done = wait(futures, timeout=SEARCH_BACKEND_TIMEOUT)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in not_done:
+        backend, page = futures[future]
+        print(f"⏱️ {backend.name} page {page} exceeded the {SEARCH_BACKEND_TIMEOUT}s search budget. Ignoring it.")
+
+    # Concatenate each backend's pages in order so ranks are per backend, not per page
+    per_backend = {backend.name: {} for backend in backends}
+    for future in done:
+        backend, page = futures[future]
+        try:
+            per_backend[backend.name][page] = future.result()
+        except Exception as e:
+            print(f"❌ Error during {backend.name} search for \"{query}\" (page {page}): {e}")
+            # Potentially check for specific quota errors if needed
+            if "quotaexceeded" in str(e).lower() or "daily limit exceeded" in str(e).lower():
+                print("   This might be a Google API quota issue. Check your Google Cloud Console.")
+
+    result_lists = []
+    for name, pages in per_backend.items():
+        results = [result for page in sorted(pages) for result in pages[page]]
+        print(f"   {name}: {len(results)} results")
+        result_lists.append(results)
+
+    fused_results = reciprocal_rank_fusion(result_lists, max_results)
+    if fused_results:
+        print(f"🔍 Found {len(fused_results)} unique results for \"{query}\" after fusion.")
+    else:
+        print(f"⚠️ No results found for \"{query}\".")
+    return fused_results
+
 
 def search_web_google(query: str, max_results: int = 5):
     """
-    Performs a web search using Google Custom Search API.
+    Performs a web search using Google Custom Search API only.
 
     Args:
         query (str): The search query.
         max_results (int): The maximum number of search results to return.
-                           (Note: Google API returns up to 10 per request)
+                           (Google returns up to 10 per request; more are fetched page by page, up to 100.)
 
     Returns:
         list: A list of search result dictionaries, formatted to be similar
               to what DDG provided: {'title': ..., 'href': ..., 'body': ...}.
+              If a later page fails, the results already collected are returned.
               Returns an empty list if the search fails or yields no results.
     """
     print(f"🔎 Searching Google for: \"{query}\" (requesting up to {max_results} results)")
+    backend = SEARCH_BACKENDS["google"]
 
-    if not GOOGLE_API_KEY or not GOOGLE_CSE_ID:
+    if not backend.is_configured():
         print("❌ Google API Key or CSE ID not found in environment variables.")
         print("   Please ensure GOOGLE_API_KEY and GOOGLE_CSE_ID are set in your .env file.")
         return []
 
-    # Add a small delay to be a good citizen, though API usage is metered by Google
-    time.sleep(1)
-
-    try:
-        # Build a service object for interacting with the API
-        service = build("customsearch", "v1", developerKey=GOOGLE_API_KEY)
-        
-        # Google API returns 10 results by default, and max 10 per request using 'num' parameter.
-        # If max_results > 10, multiple requests would be needed, but for simplicity,
-        # we'll cap at 10 for a single request here, or adjust 'num'.
-        num_results_to_request = min(max_results, 10) # Google API 'num' parameter max is 10
+    formatted_results = []
+    page = 1
+    while len(formatted_results) < max_results:
+        try:
+            page_results = backend.search(query, page, max_results - len(formatted_results))
+        except Exception as e:
+            print(f"❌ Error during Google Custom Search for \"{query}\" (page {page}): {e}")
+            # Potentially check for specific quota errors if needed
+            if "quotaexceeded" in str(e).lower() or "daily limit exceeded" in str(e).lower():
+                print("   This might be a Google API quota issue. Check your Google Cloud Console.")
+            break # Keep whatever earlier pages returned
+        if not page_results:
+            break
+        formatted_results.extend(page_results)
+        page += 1
 
-        response = service.cse().list(
-            q=query,                # Search query
-            cx=GOOGLE_CSE_ID,       # Custom Search Engine ID
-            num=num_results_to_request  # Number of results to return (1-10)
-            # You can add other parameters like 'lr' for language restrictions, etc.
-            # e.g., lr='lang_en'
-        ).execute()
-
-        formatted_results = []
-        if 'items' in response:
-            for item in response['items']:
-                formatted_results.append({
-                    'title': item.get('title'),
-                    'href': item.get('link'), # Google calls the URL 'link'
-                    'body': item.get('snippet') # Google calls the snippet 'snippet'
-                })
-            print(f"🔍 Found {len(formatted_results)} results from Google for \"{query}\".")
-        else:
-            print(f"⚠️ No results found from Google for \"{query}\".")
-        
-        return formatted_results
-
-    except Exception as e:
-        print(f"❌ Error during Google Custom Search for \"{query}\": {e}")
-        # Potentially check for specific quota errors if needed
-        if "quotaExceeded" in str(e).lower() or "daily limit exceeded" in str(e).lower():
-            print("   This might be a Google API quota issue. Check your Google Cloud Console.")
-        return []
+    if formatted_results:
+        print(f"🔍 Found {len(formatted_results)} results from Google for \"{query}\".")
+    else:
+        print(f"⚠️ No results found from Google for \"{query}\".")
+    return formatted_results[:max_results]
 
 # --- Alias to the preferred search function ---
-# Now explicitly point to the Google search function
-search_web = search_web_google
+# Fan out to every configured backend and fuse the results
+search_web = search_web_fused
 
 
 if __name__ == '__main__':
     # Example usage for testing this module directly
-    print("--- Testing search_utils.py with Google Search ---")
+    print("--- Testing search_utils.py result fusion (offline) ---")
+    fused = reciprocal_rank_fusion([
+        [{'href': 'https://www.example.com/a/', 'title': 'A'}, {'href': 'https://example.com/b', 'title': 'B'}],
+        [{'href': 'https://example.com/b?utm_source=x', 'title': 'B (dup)'}, {'href': 'https://example.com/c', 'title': 'C'}],
+    ], max_results=5)
+    print(f"  Fused order: {[r['title'] for r in fused]}") # B first: ranked by both backends
+
+    print("\n--- Testing search_utils.py with Google Search ---")
     
     if not GOOGLE_API_KEY or not GOOGLE_CSE_ID:
         print("🚫 GOOGLE_API_KEY or GOOGLE_CSE_ID not set. Skipping live Google Search test.")